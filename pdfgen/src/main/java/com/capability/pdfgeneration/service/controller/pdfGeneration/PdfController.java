@@ -16,6 +16,7 @@ import java.io.IOException;
 import java.io.InputStream;
 import java.util.ArrayList;
 import java.util.List;
+import java.util.stream.Collectors;
 
 @MultipartConfig(maxFileSize = 10 * 1024 * 1024) // 10 MB
 @RestController
@@ -51,6 +52,7 @@ public class PdfController  {
             @RequestPart("pdf") MultipartFile pdf,
             @RequestPart("image") MultipartFile image,
             @RequestParam(defaultValue = "1") int page,
+            @RequestParam(required = false) List<Integer> pages,   // e.g. pages=1,3,5 stamps all in one pass
             @RequestParam float x,
             @RequestParam float y,
             @RequestParam(required = false) Float width,
@@ -65,10 +67,12 @@ public class PdfController  {
                 ? PdfService.Anchor.TOP_LEFT
                 : PdfService.Anchor.BOTTOM_LEFT;
 
+        List<Integer> stampPages = (pages == null || pages.isEmpty()) ? List.of(page) : pages;
+
         byte[] out = pdfService.stampImage(
                 pdf.getBytes(),
                 image.getBytes(),
-                page,
+                stampPages,
                 x, y,
                 width, height,
                 unitEnum, anchorEnum,
@@ -77,6 +81,7 @@ public class PdfController  {
 
         return ResponseEntity.ok()
                 .header(HttpHeaders.CONTENT_TYPE, "application/pdf")
+                .header("X-Stamped-Pages", stampPages.stream().map(String::valueOf).collect(Collectors.joining(",")))
                 .header(HttpHeaders.CONTENT_DISPOSITION, "inline; filename=stamped.pdf")
                 .body(out);
     }
@@ -99,7 +99,24 @@ public class PdfService {
                              Float wIn, Float hIn,
                              Unit units, Anchor anchor,
                              Float opacity) throws IOException {
-        if (pageNumber < 1) throw new IllegalArgumentException("page must be >= 1");
+        return stampImage(pdfBytes, imageBytes, List.of(pageNumber), xIn, yIn, wIn, hIn, units, anchor, opacity);
+    }
+
+    /**
+     * Stamps the same image onto several pages in a single load/save pass.
+     * Same parameters as {@link #stampImage(byte[], byte[], int, float, float, Float, Float, Unit, Anchor, Float)},
+     * with a list of 1-based page numbers instead of one.
+     */
+    public byte[] stampImage(byte[] pdfBytes, byte[] imageBytes,
+                             List<Integer> pageNumbers,
+                             float xIn, float yIn,
+                             Float wIn, Float hIn,
+                             Unit units, Anchor anchor,
+                             Float opacity) throws IOException {
+        if (pageNumbers == null || pageNumbers.isEmpty()) throw new IllegalArgumentException("at least one page is required");
+        for (int pageNumber : pageNumbers) {
+            if (pageNumber < 1) throw new IllegalArgumentException("page must be >= 1");
+        }
         final float mmToPt = 72f / 25.4f;
 
         float x = (units == Unit.MM) ? xIn * mmToPt : xIn;
@@ -108,11 +125,13 @@ public class PdfService {
         try (PDDocument doc = Loader.loadPDF(pdfBytes);
              ByteArrayOutputStream out = new ByteArrayOutputStream()) {
 
-            if (pageNumber > doc.getNumberOfPages()) {
-                throw new IllegalArgumentException("page out of range");
+            for (int pageNumber : pageNumbers) {
+                if (pageNumber > doc.getNumberOfPages()) {
+                    throw new IllegalArgumentException("page out of range");
+                }
             }
 
-            PDPage page = doc.getPage(pageNumber - 1);
+            // One XObject shared by every stamped page
             PDImageXObject img = PDImageXObject.createFromByteArray(doc, imageBytes, "stamp");
 
             float iw = img.getWidth(), ih = img.getHeight();
@@ -125,35 +144,39 @@ public class PdfService {
             else if (w == null /*h!=null*/)    { drawH = h;              drawW = iw * (h / ih); }
             else                               { drawW = w;              drawH = h; }
 
-            // Anchor & rotation
-            PDRectangle box = page.getCropBox();
-            float pageW = box.getWidth(), pageH = box.getHeight();
-            float userX = x;
-            float userY = (anchor == Anchor.TOP_LEFT) ? (pageH - y - drawH) : y;
-
-            int rot = ((page.getRotation() % 360) + 360) % 360;
-            Matrix m = new Matrix();
-            switch (rot) {
-                case 0 -> m.translate(userX, userY);
-                case 90 -> { m.translate(pageW - userY - drawH, userX); m.rotate((float) Math.toRadians(90)); }
-                case 180 -> { m.translate(pageW - userX - drawW, pageH - userY - drawH); m.rotate((float) Math.toRadians(180)); }
-                case 270 -> { m.translate(userY, pageH - userX - drawW); m.rotate((float) Math.toRadians(270)); }
-                default -> m.translate(userX, userY);
-            }
-            m.scale(drawW, drawH);
+            for (int pageNumber : pageNumbers) {
+                PDPage page = doc.getPage(pageNumber - 1);
+
+                // Anchor & rotation
+                PDRectangle box = page.getCropBox();
+                float pageW = box.getWidth(), pageH = box.getHeight();
+                float userX = x;
+                float userY = (anchor == Anchor.TOP_LEFT) ? (pageH - y - drawH) : y;
+
+                int rot = ((page.getRotation() % 360) + 360) % 360;
+                Matrix m = new Matrix();
+                switch (rot) {
+                    case 0 -> m.translate(userX, userY);
+                    case 90 -> { m.translate(pageW - userY - drawH, userX); m.rotate((float) Math.toRadians(90)); }
+                    case 180 -> { m.translate(pageW - userX - drawW, pageH - userY - drawH); m.rotate((float) Math.toRadians(180)); }
+                    case 270 -> { m.translate(userY, pageH - userX - drawW); m.rotate((float) Math.toRadians(270)); }
+                    default -> m.translate(userX, userY);
+                }
+                m.scale(drawW, drawH);
 
-            // IMPORTANT: Append mode; resetContext=true; compress=true
-            try (PDPageContentStream cs = new PDPageContentStream(
-                    doc, page, PDPageContentStream.AppendMode.APPEND, true, true)) {
+                // IMPORTANT: Append mode; resetContext=true; compress=true
+                try (PDPageContentStream cs = new PDPageContentStream(
+                        doc, page, PDPageContentStream.AppendMode.APPEND, true, true)) {
 
-                if (opacity != null) {
-                    PDExtendedGraphicsState gs = new PDExtendedGraphicsState();
-                    gs.setNonStrokingAlphaConstant(Math.max(0f, Math.min(1f, opacity)));
-                    cs.setGraphicsStateParameters(gs);
-                }
+                    if (opacity != null) {
+                        PDExtendedGraphicsState gs = new PDExtendedGraphicsState();
+                        gs.setNonStrokingAlphaConstant(Math.max(0f, Math.min(1f, opacity)));
+                        cs.setGraphicsStateParameters(gs);
+                    }
 
-                cs.drawImage(img, m);
-                // (No fill/stroke/color changes; nothing to “white out”.)
+                    cs.drawImage(img, m);
+                    // (No fill/stroke/color changes; nothing to “white out”.)
+                }
             }
 
             doc.save(out);
@@ -62,20 +62,21 @@ def escape_slashes(obj: Any) -> Any:
         return obj
 
 
-def main() -> None:
-    base_dir = Path(__file__).resolve().parent
-    input_dir = base_dir / "input"
-    output_dir = base_dir / "output"
+def run(base_data: Dict[str, Any], input_dir: Path = None) -> Any:
+    """
+    Merge docInfo/pdf_insert/ui/optionList JSONs from input_dir into base_data
+    (the parsed input.json) and return the resolved, slash-escaped result.
+    """
+    if input_dir is None:
+        input_dir = Path(__file__).resolve().parent / "input"
 
     # Paths to input files
-    input_json_path = input_dir / "input.json"
     docinfo_json_path = input_dir / "docInfo.json"
     pdf_insert_json_path = input_dir / "pdf_insert.json"
     ui_json_path = input_dir / "ui.json"
     optionlist_json_path = input_dir / "optionList.json"
 
     # Load JSONs
-    base_data = load_json(input_json_path)
     docinfo_data = load_json(docinfo_json_path)
     pdf_insert_data = load_json(pdf_insert_json_path)
     ui_data = load_json(ui_json_path)
@@ -94,7 +95,15 @@ def main() -> None:
     merge_ui_fields(letter_data, ui_data)
 
     # Escape '/' as '//' in all string values
-    output_data = escape_slashes(base_data)
+    return escape_slashes(base_data)
+
+
+def main() -> None:
+    base_dir = Path(__file__).resolve().parent
+    input_dir = base_dir / "input"
+    output_dir = base_dir / "output"
+
+    output_data = run(load_json(input_dir / "input.json"), input_dir)
 
     # Ensure output directory exists
     output_dir.mkdir(parents=True, exist_ok=True)
@@ -1,513 +1,794 @@
 #!/usr/bin/env python3
 """
-Pipeline automation script that runs the data processing programs sequentially.
+Pipeline automation script that runs the data processing programs.
+
+Each step declares the steps it depends on and is scheduled with asyncio,
+so steps that don't depend on each other (e.g. the JSON data population
+chain and the docx header/footer merge) run concurrently.
 """
 
-import subprocess
+import asyncio
+import contextlib
+import errno
+import functools
+import importlib.util
+import json
+import logging
+import mmap
+import re
 import shutil
 import os
+import random
+import statistics
+import sys
+import time
 from pathlib import Path
 
+import aiofiles  # pip install aiofiles
+import httpx  # pip install "httpx[http2]"
+import orjson  # pip install orjson
+from pypdf import PdfReader, PdfWriter  # pip install pypdf
+from pypdf.generic import NameObject
 
-def run_command(cmd: list, cwd: str = None, input_text: str = None) -> bool:
-    """Run a command and return True if successful."""
-    print(f"\n{'='*60}")
-    print(f"Running: {' '.join(cmd)}")
-    if cwd:
-        print(f"Working directory: {cwd}")
-    print('='*60)
-    
-    try:
-        result = subprocess.run(
-            cmd,
-            cwd=cwd,
-            input=input_text,
-            text=True,
-            capture_output=True
-        )
-        print(result.stdout)
-        if result.stderr:
-            print(f"STDERR: {result.stderr}")
-        
-        if result.returncode != 0:
-            print(f"ERROR: Command failed with return code {result.returncode}")
+
+log = logging.getLogger("pipeline")
+
+# Banner rules, built once (set PIPELINE_LOG=WARNING to skip banners entirely)
+HASHBAR = "#" * 70
+BANNER = "=" * 70
+RULE = "=" * 60
+
+# Upper bound on child processes the pipeline runs at the same time
+MAX_CONCURRENT_COMMANDS = 8
+_command_slots = asyncio.Semaphore(MAX_CONCURRENT_COMMANDS)
+
+# Longest line of child process output the pipeline will read (asyncio's default is 64 KiB)
+OUTPUT_LINE_LIMIT = 16 * 1024 * 1024
+
+# Buffer size for userspace file copies (same as shutil's default)
+COPY_BUFSIZE = 256 * 1024
+# errnos meaning a kernel copy path isn't available for these files
+_KERNEL_COPY_UNSUPPORTED = {errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.ENOTSOCK, errno.ENOTSUP}
+
+# Requests answered with these statuses are retried (with backoff) this many times
+RETRY_STATUSES = {429, 503}
+MAX_RETRIES = 4
+# Initial number of concurrent stamp-image requests (adapted at runtime)
+STAMP_CONCURRENCY = int(os.environ.get("STAMP_CONCURRENCY", "4"))
+
+# Page count fallback: how much of the end of a PDF to search for /Count first
+PDF_TAIL_SCAN_SIZE = 64 * 1024
+_PDF_COUNT_RE = re.compile(rb'/Count\s+(\d+)')
+
+
+def log_step(title: str) -> None:
+    """Log the header for a pipeline step."""
+    log.info("\n\n%s\n# %s\n%s", HASHBAR, title, HASHBAR)
+
+
+def log_banner(msg: str, *args, rule: str = RULE) -> None:
+    """Log msg % args framed by a rule above and below."""
+    log.info("\n%s\n" + msg + "\n%s", rule, *args, rule)
+
+
+async def run_command(cmd: list, cwd: str = None, input_text: str = None, label: str = None) -> bool:
+    """
+    Run a command and return True if successful.
+    Its output is echoed line by line, prefixed with `label` (default: the
+    program name) since concurrent steps' output interleaves.
+    """
+    prefix = f"[{label or Path(cmd[0]).name}] "
+    async with _command_slots:
+        if cwd:
+            log_banner("Running: %s\nWorking directory: %s", " ".join(cmd), cwd)
+        else:
+            log_banner("Running: %s", " ".join(cmd))
+
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd,
+                cwd=cwd,
+                stdin=asyncio.subprocess.PIPE if input_text is not None else None,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+                limit=OUTPUT_LINE_LIMIT
+            )
+            if input_text is not None:
+                proc.stdin.write(input_text.encode())
+                await proc.stdin.drain()
+                proc.stdin.close()
+
+            # Echo output as it arrives instead of buffering it all until the
+            # command exits
+            async for line in proc.stdout:
+                print(prefix + line.decode(errors="replace").rstrip("\r\n"), flush=True)
+            await proc.wait()
+
+            if proc.returncode != 0:
+                log.error("ERROR: Command failed with return code %d", proc.returncode)
+                return False
+            return True
+        except Exception as e:
+            log.error("ERROR: %s", e)
             return False
-        return True
-    except Exception as e:
-        print(f"ERROR: {e}")
-        return False
 
 
-def rename_file(src: Path, dst: Path) -> bool:
-    """Rename a file from src to dst."""
-    print(f"\n{'='*60}")
-    print(f"Renaming: {src} -> {dst}")
-    print('='*60)
-    
-    try:
-        if dst.exists():
-            dst.unlink()
-        src.rename(dst)
-        print(f"Successfully renamed to {dst}")
-        return True
-    except Exception as e:
-        print(f"ERROR: Failed to rename file: {e}")
-        return False
+class AdaptiveLimiter:
+    """
+    Bounds concurrent requests to a rate-limited API. Starts with `limit`
+    slots and halves them when the API throttles (429/503) or the latency
+    EWMA of successful requests grows past twice the baseline (the median
+    of the first few successes); adds a slot back while latency stays close
+    to that baseline.
+    """
+
+    def __init__(self, limit: int, smoothing: float = 0.3, baseline_samples: int = 5):
+        self.max_limit = self.limit = max(1, limit)
+        self.smoothing = smoothing
+        self.baseline_samples = baseline_samples
+        self.baseline = None
+        self.ewma = None
+        self._warmup = []
+        self._active = 0
+        self._changed = asyncio.Condition()
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        async with self._changed:
+            await self._changed.wait_for(lambda: self._active < self.limit)
+            self._active += 1
+        try:
+            yield
+        finally:
+            async with self._changed:
+                self._active -= 1
+                self._changed.notify_all()
+
+    def throttled(self) -> None:
+        """The API pushed back; halve the concurrency."""
+        self.limit = max(1, self.limit // 2)
+
+    def record(self, latency: float) -> None:
+        """Record the latency of a successful request."""
+        if self.baseline is None:
+            self._warmup.append(latency)
+            if len(self._warmup) >= self.baseline_samples:
+                self.baseline = statistics.median(self._warmup)
+            return
+
+        if self.ewma is None:
+            self.ewma = latency
+        else:
+            self.ewma = self.smoothing * latency + (1 - self.smoothing) * self.ewma
+
+        if self.ewma > 2 * self.baseline:
+            self.throttled()
+            self.ewma = None  # re-measure at the new limit
+        elif self.ewma < 1.2 * self.baseline and self.limit < self.max_limit:
+            self.limit += 1
+
+
+async def post_form(client: httpx.AsyncClient, url: str, files: dict, output_file: Path = None,
+                    limiter: AdaptiveLimiter = None):
+    """
+    POST multipart/form-data to url and return the response, or None if the
+    request failed. With output_file the response body is streamed to it in
+    chunks; otherwise it is printed. 429/503 responses are retried with
+    exponential backoff; with a limiter, each attempt takes one of its slots.
+    """
+    if output_file:
+        log_banner("Calling: %s\nSaving response to: %s", url, output_file)
+    else:
+        log_banner("Calling: %s", url)
+
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            async with (limiter.slot() if limiter else contextlib.nullcontext()):
+                started = time.monotonic()
+                async with client.stream("POST", url, files=files) as response:
+                    if response.status_code in RETRY_STATUSES and attempt < MAX_RETRIES:
+                        status = response.status_code
+                    elif response.is_error:
+                        await response.aread()
+                        log.error("%s", response.text)
+                        log.error("ERROR: Request failed with HTTP %d", response.status_code)
+                        return None
+                    else:
+                        if output_file:
+                            async with aiofiles.open(output_file, 'wb') as f:
+                                async for chunk in response.aiter_bytes(COPY_BUFSIZE):
+                                    await f.write(chunk)
+                        else:
+                            await response.aread()
+                            log.info("%s", response.text)
+                        if limiter:
+                            limiter.record(time.monotonic() - started)
+                        return response
+        except Exception as e:
+            log.error("ERROR: %s", e)
+            return None
+
+        if limiter:
+            limiter.throttled()
+        delay = 2 ** attempt + random.random()
+        log.warning("HTTP %d from %s, retrying in %.1fs", status, url, delay)
+        await asyncio.sleep(delay)
+
+
+async def run_steps(steps: dict) -> bool:
+    """
+    Run pipeline steps as soon as their dependencies have finished.
+
+    `steps` maps a step name to a (coroutine function, dependency names) tuple.
+    Steps whose dependencies are satisfied run concurrently; a failed step
+    skips every step that depends on it. Returns True if all steps succeeded.
+    """
+    tasks = {}
+
+    async def run_step(step, deps):
+        for dep in deps:
+            if not await tasks[dep]:
+                return False
+        try:
+            return await step()
+        except Exception as e:
+            log.error("ERROR: %s", e)
+            return False
+
+    for name, (step, deps) in steps.items():
+        tasks[name] = asyncio.create_task(run_step(step, deps))
+
+    results = await asyncio.gather(*tasks.values())
+    return all(results)
+
+
+def splice_pages(base_pdf: Path, page_sources: dict, output_file: Path) -> None:
+    """
+    Write base_pdf to output_file with the content of page N taken from the
+    PDF at page_sources[N] (base_pdf with page N stamped) wherever one is
+    given. The base document is cloned and only each stamped page's
+    /Contents and /Resources are swapped in, so catalog-level content
+    (outlines, structure tree, AcroForm, XMP metadata) is kept.
+    """
+    # Keep every reader alive until the write: pypdf keys its clone cache on
+    # id(reader), so a collected reader's id can be reused by the next one
+    base = PdfReader(base_pdf)
+    sources = {number: PdfReader(path) for number, path in page_sources.items()}
+
+    writer = PdfWriter(clone_from=base)
+    for number, source in sources.items():
+        stamped = source.pages[number - 1]
+        page = writer.pages[number - 1]
+        for key in ("/Contents", "/Resources"):
+            if key in stamped:
+                page[NameObject(key)] = stamped.raw_get(key).clone(writer)
+    # Every stamped source carries its own copy of the shared fonts/images,
+    # and the replaced page contents are left orphaned. (Two passes: doing
+    # both in one call garbles shared fonts in pypdf 6.)
+    writer.compress_identical_objects(remove_identicals=True, remove_orphans=False)
+    writer.compress_identical_objects(remove_identicals=False, remove_orphans=True)
+
+    with open(output_file, 'wb') as f:
+        writer.write(f)
+
+
+def load_module(path: Path):
+    """Import a Python file by path (the stage folders have spaces in their names)."""
+    spec = importlib.util.spec_from_file_location(path.stem, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def copy_file_contents(src: Path, dst: Path) -> None:
+    """
+    Copy the bytes of src into dst without copying metadata (the pipeline
+    files are transient, so copystat's chmod/utime calls are wasted work).
+    Uses copy_file_range, then sendfile, so the data stays in the kernel;
+    falls back to a userspace read/write loop with a reused buffer.
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        in_fd, out_fd = fsrc.fileno(), fdst.fileno()
+        size = os.fstat(in_fd).st_size
+        copied = 0
+
+        def _copy_file_range(count):
+            return os.copy_file_range(in_fd, out_fd, count, copied, copied)
+
+        def _sendfile(count):
+            os.lseek(out_fd, copied, os.SEEK_SET)
+            return os.sendfile(out_fd, in_fd, copied, count)
+
+        kernel_copies = [_sendfile]
+        if hasattr(os, "copy_file_range"):  # Linux 4.5+
+            kernel_copies.insert(0, _copy_file_range)
+
+        for kernel_copy in kernel_copies:
+            try:
+                while copied < size:
+                    n = kernel_copy(size - copied)
+                    if n == 0:
+                        break
+                    copied += n
+                if copied >= size:
+                    return
+            except OSError as e:
+                if e.errno not in _KERNEL_COPY_UNSUPPORTED:
+                    raise
+
+        fsrc.seek(copied)
+        fdst.seek(copied)
+        with memoryview(bytearray(COPY_BUFSIZE)) as buf:
+            while n := fsrc.readinto(buf):
+                fdst.write(buf[:n])
 
 
 def copy_file(src: Path, dst: Path) -> bool:
-    """Copy a file from src to dst."""
-    print(f"\n{'='*60}")
-    print(f"Copying: {src} -> {dst}")
-    print('='*60)
-    
+    """
+    Copy a file from src to dst.
+    On the same filesystem dst is hardlinked to src (no data copied); the link
+    is made under a temporary name and moved over dst so an existing dst is
+    replaced atomically. Note that a hardlinked dst then changes whenever src
+    is rewritten in place (several of these dst files are tracked in git).
+    """
+    log_banner("Copying: %s -> %s", src, dst)
+
     try:
         dst.parent.mkdir(parents=True, exist_ok=True)
-        shutil.copy2(src, dst)
-        print(f"Successfully copied to {dst}")
+        if dst.exists() and os.path.samefile(src, dst):
+            # Already linked by a previous run; src was rewritten in place
+            log.info("Already up to date: %s", dst)
+            return True
+
+        tmp = dst.with_name(dst.name + ".tmp")
+        try:
+            tmp.unlink(missing_ok=True)
+            os.link(src, tmp)
+            os.replace(tmp, dst)
+        except OSError as e:
+            tmp.unlink(missing_ok=True)
+            # Different filesystem, or one that doesn't support hardlinks
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.ENOTSUP):
+                raise
+            copy_file_contents(src, dst)
+        log.info("Successfully copied to %s", dst)
         return True
     except Exception as e:
-        print(f"ERROR: Failed to copy file: {e}")
+        log.error("ERROR: Failed to copy file: %s", e)
         return False
 
 
-def main():
+async def main():
     # Base directory (where this script is located)
     base_dir = Path(__file__).resolve().parent
-    
+
     # Contract number to use
     contract_number = "381034"
-    
+
     # Get virtual environment Python path for cds_mapping.py (needs requests package)
     cds_folder = base_dir / "cds data population"
     venv_python = cds_folder / ".venv" / "bin" / "python3"
     if not venv_python.exists():
-        print(f"ERROR: Virtual environment not found at {venv_python}")
-        print("Please create it with: python3 -m venv 'cds data population/.venv'")
+        log.error("ERROR: Virtual environment not found at %s", venv_python)
+        log.error("Please create it with: python3 -m venv 'cds data population/.venv'")
         return 1
-    
-    print("\n" + "="*70)
-    print("PIPELINE AUTOMATION SCRIPT")
-    print(f"Contract Number: {contract_number}")
-    print("="*70)
-    
-    # Step 1: Run cds_mapping.py with contract number input
-    print("\n\n" + "#"*70)
-    print("# STEP 1: Running cds_mapping.py")
-    print("#"*70)
-    
-    cds_script = cds_folder / "cds_mapping.py"
-    
-    if not run_command(
-        [str(venv_python), str(cds_script)],
-        cwd=str(cds_folder),
-        input_text=contract_number + "\n"
-    ):
-        print("ERROR: Step 1 failed - cds_mapping.py")
-        return 1
-    
-    # Step 2: Rename output.json to input.json in cds data population/output
-    print("\n\n" + "#"*70)
-    print("# STEP 2: Renaming output.json to input.json in cds data population/output")
-    print("#"*70)
-    
+
+    # Paths shared between steps
     cds_output_file = cds_folder / "output" / "output.json"
-    cds_renamed_file = cds_folder / "output" / "input.json"
-    
-    if not rename_file(cds_output_file, cds_renamed_file):
-        print("ERROR: Step 2 failed - renaming output.json")
-        return 1
-    
-    # Step 3: Transfer input.json to rest of the data population/input
-    print("\n\n" + "#"*70)
-    print("# STEP 3: Transferring input.json to rest of the data population/input")
-    print("#"*70)
-    
+
     rest_folder = base_dir / "rest of the data population"
-    rest_input_folder = rest_folder / "input"
-    rest_input_file = rest_input_folder / "input.json"
-    
-    if not copy_file(cds_renamed_file, rest_input_file):
-        print("ERROR: Step 3 failed - transferring input.json")
-        return 1
-    
-    # Step 4: Run merge_letterdata.py
-    print("\n\n" + "#"*70)
-    print("# STEP 4: Running merge_letterdata.py")
-    print("#"*70)
-    
-    merge_script = rest_folder / "merge_letterdata.py"
-    
-    if not run_command(
-        ["python3", str(merge_script)],
-        cwd=str(rest_folder)
-    ):
-        print("ERROR: Step 4 failed - merge_letterdata.py")
-        return 1
-    
-    # Step 5: Rename output.json to input.json in rest of the data population/output
-    print("\n\n" + "#"*70)
-    print("# STEP 5: Renaming output.json to input.json in rest of the data population/output")
-    print("#"*70)
-    
     rest_output_file = rest_folder / "output" / "output.json"
-    rest_renamed_file = rest_folder / "output" / "input.json"
-    
-    if not rename_file(rest_output_file, rest_renamed_file):
-        print("ERROR: Step 5 failed - renaming output.json")
-        return 1
-    
-    # Step 6: Transfer input.json to scriptResolution/src/main/resources/input
-    print("\n\n" + "#"*70)
-    print("# STEP 6: Transferring input.json to scriptResolution/src/main/resources/input")
-    print("#"*70)
-    
+
     script_resolution_folder = base_dir / "scriptResolution"
-    script_resolution_input = script_resolution_folder / "src" / "main" / "resources" / "input"
-    script_resolution_input_file = script_resolution_input / "input.json"
-    
-    if not copy_file(rest_renamed_file, script_resolution_input_file):
-        print("ERROR: Step 6 failed - transferring input.json")
-        return 1
-    
-    # Step 7: Compile and run ExprEval.java
-    print("\n\n" + "#"*70)
-    print("# STEP 7: Running ExprEval.java (using Maven wrapper)")
-    print("#"*70)
-    
-    # Use Maven wrapper from pdfgen folder
-    mvnw = base_dir / "pdfgen" / "mvnw"
-    
-    # First, compile the project using Maven
-    if not run_command(
-        [str(mvnw), "compile", "-q", "-f", str(script_resolution_folder / "pom.xml")],
-        cwd=str(script_resolution_folder)
-    ):
-        print("ERROR: Step 7 failed - Maven compile")
-        return 1
-    
-    # Then run the main class (exec-maven-plugin is already configured in pom.xml)
-    if not run_command(
-        [str(mvnw), "exec:java", "-q", "-f", str(script_resolution_folder / "pom.xml")],
-        cwd=str(script_resolution_folder)
-    ):
-        print("ERROR: Step 7 failed - running ExprEval")
-        return 1
-    
-    # Step 8: Copy output.json to input.json in scriptResolution/src/main/resources/output
-    # (Keep output.json for ObjInserter which needs it later)
-    print("\n\n" + "#"*70)
-    print("# STEP 8: Copying output.json to input.json in scriptResolution resources/output")
-    print("#"*70)
-    
-    script_resolution_output = script_resolution_folder / "src" / "main" / "resources" / "output"
+    script_resolution_pom = str(script_resolution_folder / "pom.xml")
+    script_resolution_resources = script_resolution_folder / "src" / "main" / "resources"
+    script_resolution_input_file = script_resolution_resources / "input" / "input.json"
+    script_resolution_output = script_resolution_resources / "output"
     script_resolution_output_file = script_resolution_output / "output.json"
-    script_resolution_renamed_file = script_resolution_output / "input.json"
-    
-    if not copy_file(script_resolution_output_file, script_resolution_renamed_file):
-        print("ERROR: Step 8 failed - copying output.json to input.json")
-        return 1
-    
-    # Step 9: Transfer input.json to pdfgen/src/main/resources/test
-    print("\n\n" + "#"*70)
-    print("# STEP 9: Transferring input.json to pdfgen/src/main/resources/test")
-    print("#"*70)
-    
-    pdfgen_test_folder = base_dir / "pdfgen" / "src" / "main" / "resources" / "testInput"
-    pdfgen_input_file = pdfgen_test_folder / "input.json"
-    
-    if not copy_file(script_resolution_renamed_file, pdfgen_input_file):
-        print("ERROR: Step 9 failed - transferring input.json")
-        return 1
-    
-    # Step 10: Run MergeBodyIntoFooter.java in docx_merging
-    print("\n\n" + "#"*70)
-    print("# STEP 10: Running MergeBodyIntoFooter.java")
-    print("#"*70)
-    
+
     docx_merging_folder = base_dir / "docx_merging"
-    
-    # Compile the project using Maven wrapper
-    if not run_command(
-        [str(mvnw), "compile", "-q", "-f", str(docx_merging_folder / "pom.xml")],
-        cwd=str(base_dir)  # Run from base_dir since Java uses "docx_merging/src/main/resources" path
-    ):
-        print("ERROR: Step 10 failed - Maven compile for docx_merging")
-        return 1
-    
-    # Run the main class (from base_dir since Java uses relative path "docx_merging/src/main/resources")
-    if not run_command(
-        [str(mvnw), "exec:java", "-Dexec.mainClass=org.example.MergeBodyIntoFooter", "-q", "-f", str(docx_merging_folder / "pom.xml")],
-        cwd=str(base_dir)
-    ):
-        print("ERROR: Step 10 failed - running MergeBodyIntoFooter")
-        return 1
-    
-    # Step 11: Copy dest-with-header-footer.docx to pdfgen testInput
-    print("\n\n" + "#"*70)
-    print("# STEP 11: Copying dest-with-header-footer.docx to pdfgen testInput")
-    print("#"*70)
-    
-    docx_source = docx_merging_folder / "src" / "main" / "resources" / "dest-with-header-footer.docx"
-    docx_dest = pdfgen_test_folder / "dest-with-header-footer.docx"
-    
-    if not copy_file(docx_source, docx_dest):
-        print("ERROR: Step 11 failed - copying dest-with-header-footer.docx")
-        return 1
-    
-    # Step 12: Upload docx to Storage API
-    print("\n\n" + "#"*70)
-    print("# STEP 12: Uploading dest-with-header-footer.docx to Storage API")
-    print("#"*70)
-    
+    docx_merging_pom = str(docx_merging_folder / "pom.xml")
+
+    pdfgen_folder = base_dir / "pdfgen"
+    pdfgen_pom = str(pdfgen_folder / "pom.xml")
+    pdfgen_resources = pdfgen_folder / "src" / "main" / "resources"
+    pdfgen_test_folder = pdfgen_resources / "testInput"
+    pdfgen_input_file = pdfgen_test_folder / "input.json"
     docx_file = pdfgen_test_folder / "dest-with-header-footer.docx"
-    storage_api_url = "https://platform.dev-capability.zinnia.com/pdfgeneration-service/storage/docxs"
-    
-    if not run_command(
-        [
-            "curl", "-X", "POST",
-            "-F", f"file=@{docx_file}",
-            storage_api_url
-        ]
-    ):
-        print("ERROR: Step 12 failed - Storage API upload")
-        return 1
-    
-    # Step 13: Call Docx-to-PDF API and save response
-    print("\n\n" + "#"*70)
-    print("# STEP 13: Calling Docx-to-PDF API and saving PDF output")
-    print("#"*70)
-    
-    render_api_url = "https://platform.dev-capability.zinnia.com/pdfgeneration-service/docx/render-to-pdf?templateName=dest-with-header-footer.docx"
-    
-    # Create testOutput folder if it doesn't exist
-    test_output_folder = base_dir / "pdfgen" / "src" / "main" / "resources" / "testOutput"
-    test_output_folder.mkdir(parents=True, exist_ok=True)
+
+    test_output_folder = pdfgen_resources / "testOutput"
     output_pdf_file = test_output_folder / "output.pdf"
-    
-    # Read the input.json content
-    with open(pdfgen_input_file, 'r', encoding='utf-8') as f:
-        json_content = f.read()
-    
-    print(f"\n{'='*60}")
-    print(f"Calling: {render_api_url}")
-    print(f"Saving response to: {output_pdf_file}")
-    print('='*60)
-    
-    try:
-        import subprocess
-        result = subprocess.run(
-            [
-                "curl", "-X", "POST",
-                "-F", f"json={json_content}",
-                render_api_url,
-                "-o", str(output_pdf_file)
-            ],
-            capture_output=True,
-            text=True
-        )
-        print(result.stdout)
-        if result.stderr:
-            print(f"STDERR: {result.stderr}")
-        
-        if result.returncode != 0:
-            print(f"ERROR: Docx-to-PDF API failed with return code {result.returncode}")
-            return 1
-        
-        print(f"\nPDF saved to: {output_pdf_file}")
-    except Exception as e:
-        print(f"ERROR: Failed to call Docx-to-PDF API: {e}")
-        return 1
-    
-    # Step 14: Run ObjInserter to generate barcode image
-    print("\n\n" + "#"*70)
-    print("# STEP 14: Running ObjInserter.java to generate barcode image")
-    print("#"*70)
-
-    # Run ObjInserter to generate barcode image from output.json
-    # (runs from base_dir since Java uses relative path "scriptResolution/src/main/resources")
-    # Uses the named execution 'run-objinserter' defined in pom.xml
-    if not run_command(
-        [str(mvnw), "exec:java@run-objinserter", "-f", str(script_resolution_folder / "pom.xml")],
-        cwd=str(base_dir)
-    ):
-        print("ERROR: Step 14 failed - running ObjInserter")
-        return 1
+    pdf13_file = test_output_folder / "output-pdf13.pdf"
+
+    object_inserter_folder = script_resolution_resources / "objectInserter"
+    barcode_image = object_inserter_folder / "sample_barcode.jpg"
+
+    # Use Maven wrapper from pdfgen folder. (Not mvnd: exec:java would run the
+    # mains inside the shared daemon JVM, where their System.exit calls kill
+    # the daemon and relative paths resolve against the daemon's directory.)
+    mvn = pdfgen_folder / "mvnw"
+
+    log_banner("PIPELINE AUTOMATION SCRIPT\nContract Number: %s", contract_number, rule=BANNER)
+
+    # Step 1: Run cds_mapping.py with contract number input
+    async def step1():
+        log_step("STEP 1: Running cds_mapping.py")
+
+        cds_script = cds_folder / "cds_mapping.py"
+
+        if not await run_command(
+            [str(venv_python), str(cds_script)],
+            cwd=str(cds_folder),
+            input_text=contract_number + "\n",
+            label="cds_mapping"
+        ):
+            log.error("ERROR: Step 1 failed - cds_mapping.py")
+            return False
+        return True
+
+    # Parsed stage outputs handed between in-process steps
+    stage_data = {}
+
+    # Step 2: Load and validate output.json from cds data population
+    # (stdlib json, not orjson: orjson turns integers wider than 64 bits into
+    # floats, and this data is carried through to the rendered letter)
+    async def step2():
+        log_step("STEP 2: Loading output.json from cds data population")
 
-    barcode_image = script_resolution_folder / "src" / "main" / "resources" / "objectInserter" / "sample_barcode.jpg"
-    
-    # Verify barcode image was created
-    if not barcode_image.exists():
-        print(f"ERROR: Barcode image not created at {barcode_image}")
-        return 1
-    print(f"Barcode image created: {barcode_image}")
-
-    # Step 15: Stamp barcode image on each page of the PDF
-    print("\n\n" + "#"*70)
-    print("# STEP 15: Stamping barcode image on each page of the PDF")
-    print("#"*70)
-
-    stamp_api_url = "https://platform.dev-capability.zinnia.com/pdfgeneration-service/pdf/stamp-image"
-    
-    # Get the number of pages in the PDF
-    page_count = get_pdf_page_count(output_pdf_file)
-    if page_count is None or page_count <= 0:
-        print("ERROR: Could not determine PDF page count")
-        return 1
-    
-    print(f"PDF has {page_count} page(s)")
-    
-    # Stamp each page
-    for page in range(1, page_count + 1, 2):
-        print(f"\n{'='*60}")
-        print(f"Stamping page {page} of {page_count}")
-        print('='*60)
-        
-        # Create a temporary file for the output
-        temp_output = script_resolution_folder / "src" / "main" / "resources" / "objectInserter" / "output_temp.pdf"
-        
         try:
-            result = subprocess.run(
-                [
-                    "curl", "-X", "POST",
-                    "-F", f"pdf=@{output_pdf_file}",
-                    "-F", f"image=@{barcode_image}",
-                    f"{stamp_api_url}?x=204&y=220.8&width=6.4&height=45.2&units=mm&anchor=top-left&page={page}",
-                    "-o", str(temp_output)
-                ],
-                capture_output=True,
-                text=True
-            )
-            
-            if result.stderr:
-                print(f"STDERR: {result.stderr}")
-            
-            if result.returncode != 0:
-                print(f"ERROR: Stamp API failed for page {page} with return code {result.returncode}")
-                return 1
-            
-            # Replace original PDF with stamped version
-            shutil.move(str(temp_output), str(output_pdf_file))
-            print(f"Page {page} stamped successfully")
-            
+            stage_data["cds_output"] = json.loads(cds_output_file.read_bytes())
+        except (OSError, json.JSONDecodeError) as e:
+            log.error("ERROR: Invalid %s: %s", cds_output_file, e)
+            log.error("ERROR: Step 2 failed - loading output.json")
+            return False
+        return True
+
+    # Step 3: Run merge_letterdata in-process on the loaded data (no second
+    # Python startup, no disk round trip) and write its output for ExprEval
+    async def step3():
+        log_step("STEP 3: Running merge_letterdata.py")
+
+        try:
+            merge_letterdata = load_module(rest_folder / "merge_letterdata.py")
+            output_data = await asyncio.to_thread(merge_letterdata.run, stage_data.pop("cds_output"))
+            rest_output_file.parent.mkdir(parents=True, exist_ok=True)
+            # Same output as merge_letterdata.main() (ASCII-escaped, indent=2)
+            rest_output_file.write_text(json.dumps(output_data, indent=2), encoding="utf-8")
+            log.info("Resolved JSON written to: %s", rest_output_file)
         except Exception as e:
-            print(f"ERROR: Failed to stamp page {page}: {e}")
+            log.error("ERROR: %s", e)
+            log.error("ERROR: Step 3 failed - merge_letterdata.py")
+            return False
+        return True
+
+    # Step 4: Transfer output.json to scriptResolution/src/main/resources/input/input.json
+    async def step4():
+        log_step("STEP 4: Transferring output.json to scriptResolution/src/main/resources/input")
+
+        if not copy_file(rest_output_file, script_resolution_input_file):
+            log.error("ERROR: Step 4 failed - transferring output.json")
+            return False
+        return True
+
+    # Step 5: Compile and run ExprEval.java
+    async def step5():
+        log_step("STEP 5: Running ExprEval.java (using Maven)")
+
+        # Compile and run the main class in one Maven invocation
+        # (exec-maven-plugin is already configured in pom.xml)
+        if not await run_command(
+            [str(mvn), "-q", "compile", "exec:java", "-f", script_resolution_pom],
+            cwd=str(script_resolution_folder),
+            label="ExprEval"
+        ):
+            log.error("ERROR: Step 5 failed - compiling/running ExprEval")
+            return False
+        return True
+
+    # Step 6: Transfer output.json to pdfgen/src/main/resources/testInput/input.json
+    # (output.json stays in place for ObjInserter, which needs it later)
+    async def step6():
+        log_step("STEP 6: Transferring output.json to pdfgen/src/main/resources/testInput")
+
+        # Fail fast on malformed ExprEval output rather than in the render API.
+        # orjson is only used to check the syntax here; the parsed value is
+        # discarded, so its 64-bit integer limit can't change the data.
+        try:
+            orjson.loads(script_resolution_output_file.read_bytes())
+        except (OSError, orjson.JSONDecodeError) as e:
+            log.error("ERROR: Invalid %s: %s", script_resolution_output_file, e)
+            log.error("ERROR: Step 6 failed - validating output.json")
+            return False
+
+        if not copy_file(script_resolution_output_file, pdfgen_input_file):
+            log.error("ERROR: Step 6 failed - transferring output.json")
+            return False
+        return True
+
+    # Step 7: Run MergeBodyIntoFooter.java in docx_merging
+    async def step7():
+        log_step("STEP 7: Running MergeBodyIntoFooter.java")
+
+        # Compile and run the main class in one Maven invocation
+        # (from base_dir since Java uses relative path "docx_merging/src/main/resources")
+        if not await run_command(
+            [str(mvn), "-q", "compile", "exec:java", "-Dexec.mainClass=org.example.MergeBodyIntoFooter", "-f", docx_merging_pom],
+            cwd=str(base_dir),
+            label="MergeBodyIntoFooter"
+        ):
+            log.error("ERROR: Step 7 failed - compiling/running MergeBodyIntoFooter")
+            return False
+        return True
+
+    # Step 8: Copy dest-with-header-footer.docx to pdfgen testInput
+    async def step8():
+        log_step("STEP 8: Copying dest-with-header-footer.docx to pdfgen testInput")
+
+        docx_source = docx_merging_folder / "src" / "main" / "resources" / "dest-with-header-footer.docx"
+
+        if not copy_file(docx_source, docx_file):
+            log.error("ERROR: Step 8 failed - copying dest-with-header-footer.docx")
+            return False
+        return True
+
+    # Step 9: Upload docx to Storage API
+    async def step9():
+        log_step("STEP 9: Uploading dest-with-header-footer.docx to Storage API")
+
+        storage_api_url = "https://platform.dev-capability.zinnia.com/pdfgeneration-service/storage/docxs"
+
+        with open(docx_file, 'rb') as f:
+            if await post_form(client, storage_api_url, {"file": (docx_file.name, f)}) is None:
+                log.error("ERROR: Step 9 failed - Storage API upload")
+                return False
+        return True
+
+    # Step 10: Call Docx-to-PDF API and save response
+    async def step10():
+        log_step("STEP 10: Calling Docx-to-PDF API and saving PDF output")
+
+        render_api_url = "https://platform.dev-capability.zinnia.com/pdfgeneration-service/docx/render-to-pdf?templateName=dest-with-header-footer.docx"
+
+        # Create testOutput folder if it doesn't exist
+        test_output_folder.mkdir(parents=True, exist_ok=True)
+
+        # Stream input.json up and the PDF down so neither is held in memory.
+        # (None, ...) sends "json" without a filename, as a plain form field.
+        with open(pdfgen_input_file, 'rb') as json_file:
+            if await post_form(client, render_api_url, {"json": (None, json_file)}, output_pdf_file) is None:
+                log.error("ERROR: Step 10 failed - Docx-to-PDF API")
+                return False
+
+        log.info("\nPDF saved to: %s", output_pdf_file)
+        return True
+
+    # Step 11: Run ObjInserter to generate barcode image
+    async def step11():
+        log_step("STEP 11: Running ObjInserter.java to generate barcode image")
+
+        # Run ObjInserter to generate barcode image from output.json
+        # (runs from base_dir since Java uses relative path "scriptResolution/src/main/resources")
+        # Uses the named execution 'run-objinserter' defined in pom.xml
+        if not await run_command(
+            [str(mvn), "exec:java@run-objinserter", "-f", script_resolution_pom],
+            cwd=str(base_dir),
+            label="ObjInserter"
+        ):
+            log.error("ERROR: Step 11 failed - running ObjInserter")
+            return False
+
+        # Verify barcode image was created
+        if not barcode_image.exists():
+            log.error("ERROR: Barcode image not created at %s", barcode_image)
+            return False
+        log.info("Barcode image created: %s", barcode_image)
+        return True
+
+    # Step 12: Stamp barcode image on each page of the PDF
+    async def step12():
+        log_step("STEP 12: Stamping barcode image on the odd pages of the PDF")
+
+        stamp_api_url = "https://platform.dev-capability.zinnia.com/pdfgeneration-service/pdf/stamp-image"
+
+        # Get the number of pages in the PDF
+        page_count = get_pdf_page_count(output_pdf_file)
+        if page_count is None or page_count <= 0:
+            log.error("ERROR: Could not determine PDF page count")
+            return False
+
+        log.info("PDF has %d page(s)", page_count)
+
+        # Everything that doesn't change between requests is built once here;
+        # each request only appends its page numbers to the URL
+        stamp_base_url = f"{stamp_api_url}?x=204&y=220.8&width=6.4&height=45.2&units=mm&anchor=top-left&page="
+        pdf_name = output_pdf_file.name
+        image_part = (barcode_image.name, barcode_image.read_bytes(), "image/jpeg")
+
+        # Create a temporary file for the output
+        temp_output = object_inserter_folder / "output_temp.pdf"
+
+        stamp_limiter = AdaptiveLimiter(STAMP_CONCURRENCY)
+
+        async def stamp_pages(pages: list, stamped_output: Path):
+            """
+            Stamp the given pages of the PDF in one request, saving the result
+            to stamped_output. Returns True/False for success/failure, or None
+            if the API ignored the batched `pages` parameter and only stamped `page`.
+            """
+            pages_csv = ",".join(map(str, pages))
+            log_banner("Stamping page(s) %s of %d", pages_csv, page_count)
+
+            with open(output_pdf_file, 'rb') as pdf:
+                response = await post_form(
+                    client,
+                    f"{stamp_base_url}{pages[0]}&pages={pages_csv}",
+                    {"pdf": (pdf_name, pdf, "application/pdf"), "image": image_part},
+                    stamped_output,
+                    limiter=stamp_limiter
+                )
+            if response is None:
+                log.error("ERROR: Stamp API failed for page(s) %s", pages_csv)
+                return False
+
+            if len(pages) > 1 and response.headers.get("X-Stamped-Pages") != pages_csv:
+                log.warning("Stamp API does not support batched pages")
+                stamped_output.unlink()
+                return None
+
+            log.info("Page(s) %s stamped successfully", pages_csv)
+            return True
+
+        # Stamp only the odd pages (1, 3, 5, ...), in a single request
+        pages = list(range(1, page_count + 1, 2))
+        stamped = await stamp_pages(pages, temp_output)
+        if stamped is None:
+            # Older deployments of the service only stamp one page per call.
+            # Stamp each odd page of the unstamped PDF concurrently (bounded by
+            # the limiter), then take page N from the result for page N.
+            log.warning("Falling back to stamping one page per request")
+            page_outputs = {page: object_inserter_folder / f"output_temp_{page}.pdf" for page in pages}
+            try:
+                results = await asyncio.gather(*(stamp_pages([page], out) for page, out in page_outputs.items()))
+                if not all(results):
+                    return False
+                await asyncio.to_thread(splice_pages, output_pdf_file, page_outputs, temp_output)
+            finally:
+                for out in page_outputs.values():
+                    out.unlink(missing_ok=True)
+        elif not stamped:
+            return False
+
+        # Replace original PDF with stamped version
+        os.replace(temp_output, output_pdf_file)
+        log.info("\nStamped page(s) %s of %d successfully!", ",".join(map(str, pages)), page_count)
+        return True
+
+    # Step 13: Convert PDF to version 1.3 (removes transparency automatically)
+    async def step13():
+        log_step("STEP 13: Converting PDF to version 1.3 (removes transparency)")
+
+        if not await run_command(
+            [
+                str(mvn), "-q", "compile", "exec:java",
+                "-Dexec.mainClass=com.capability.pdfgeneration.service.util.ConvertToPdf13",
+                f"-Dexec.args={output_pdf_file} {pdf13_file}",
+                "-f", pdfgen_pom
+            ],
+            cwd=str(pdfgen_folder),
+            label="ConvertToPdf13"
+        ):
+            log.error("ERROR: Step 13 failed - Converting to PDF 1.3")
+            return False
+
+        # Replace original PDF with PDF 1.3 version
+        log.info("\nReplacing original PDF with PDF 1.3 version...")
+        shutil.copy2(str(pdf13_file), str(output_pdf_file))
+        log.info("Done! Final PDF: %s", output_pdf_file)
+        return True
+
+    # Step 14: Final transparency check
+    async def step14():
+        log_step("STEP 14: Final Transparency Check")
+
+        if not await run_command(
+            [
+                str(mvn), "-q", "exec:java",
+                "-Dexec.mainClass=com.capability.pdfgeneration.service.util.PdfTransparencyChecker",
+                f"-Dexec.args={output_pdf_file}",
+                "-f", pdfgen_pom
+            ],
+            cwd=str(pdfgen_folder),
+            label="PdfTransparencyChecker"
+        ):
+            log.warning("WARNING: Transparency check completed (exit code indicates transparency may still exist)")
+        return True
+
+    # Step name -> (step, steps it depends on). The JSON chain (Steps 1-6) and
+    # the docx chain (Steps 7-9) are independent until the render in Step 10.
+    steps = {
+        "cds_mapping": (step1, []),
+        "load_cds_output": (step2, ["cds_mapping"]),
+        "merge_letterdata": (step3, ["load_cds_output"]),
+        "transfer_merge_output": (step4, ["merge_letterdata"]),
+        "expr_eval": (step5, ["transfer_merge_output"]),
+        "transfer_expr_eval_output": (step6, ["expr_eval"]),
+        "merge_docx": (step7, []),
+        "copy_docx": (step8, ["merge_docx"]),
+        "upload_docx": (step9, ["copy_docx"]),
+        "render_pdf": (step10, ["transfer_expr_eval_output", "upload_docx"]),
+        "generate_barcode": (step11, ["expr_eval"]),
+        "stamp_pdf": (step12, ["render_pdf", "generate_barcode"]),
+        "convert_pdf13": (step13, ["stamp_pdf"]),
+        "transparency_check": (step14, ["convert_pdf13"]),
+    }
+
+    # One client for every API call so the connection (and TLS session) to
+    # the PDF generation service is reused across steps
+    async with httpx.AsyncClient(
+        http2=True,
+        timeout=60,
+        limits=httpx.Limits(max_keepalive_connections=16)
+    ) as client:
+        if not await run_steps(steps):
+            log.error("\nERROR: Pipeline failed")
             return 1
-    
-    print(f"\nAll {page_count} pages stamped successfully!")
-    
-    # Step 16: Convert PDF to version 1.3 (removes transparency automatically)
-    print("\n\n" + "#"*70)
-    print("# STEP 16: Converting PDF to version 1.3 (removes transparency)")
-    print("#"*70)
-    
-    pdf13_file = test_output_folder / "output-pdf13.pdf"
-    
-    if not run_command(
-        [
-            str(mvnw), "-q", "compile", "exec:java",
-            "-Dexec.mainClass=com.capability.pdfgeneration.service.util.ConvertToPdf13",
-            f"-Dexec.args={output_pdf_file} {pdf13_file}",
-            "-f", str(base_dir / "pdfgen" / "pom.xml")
-        ],
-        cwd=str(base_dir / "pdfgen")
-    ):
-        print("ERROR: Step 15 failed - Converting to PDF 1.3")
-        return 1
-    
-    # Replace original PDF with PDF 1.3 version
-    print(f"\nReplacing original PDF with PDF 1.3 version...")
-    shutil.copy2(str(pdf13_file), str(output_pdf_file))
-    print(f"Done! Final PDF: {output_pdf_file}")
-    
-    # Step 17: Final transparency check
-    print("\n\n" + "#"*70)
-    print("# STEP 17: Final Transparency Check")
-    print("#"*70)
-    
-    if not run_command(
-        [
-            str(mvnw), "-q", "exec:java",
-            "-Dexec.mainClass=com.capability.pdfgeneration.service.util.PdfTransparencyChecker",
-            f"-Dexec.args={output_pdf_file}",
-            "-f", str(base_dir / "pdfgen" / "pom.xml")
-        ],
-        cwd=str(base_dir / "pdfgen")
-    ):
-        print("WARNING: Transparency check completed (exit code indicates transparency may still exist)")
-    
+
     # Done!
-    print("\n\n" + "="*70)
-    print("PIPELINE COMPLETED SUCCESSFULLY!")
-    print("="*70)
-    print(f"\nFinal JSON location: {pdfgen_input_file}")
-    print(f"Final PDF location: {output_pdf_file}")
-    print(f"PDF 1.3 version: {pdf13_file}")
-    
+    log_banner("\nPIPELINE COMPLETED SUCCESSFULLY!", rule=BANNER)
+    log.info("\nFinal JSON location: %s", pdfgen_input_file)
+    log.info("Final PDF location: %s", output_pdf_file)
+    log.info("PDF 1.3 version: %s", pdf13_file)
+
     return 0
 
 
-def get_pdf_page_count(pdf_path: Path) -> int:
-    """Get the number of pages in a PDF file."""
-    import subprocess
-    import re
-    
-    # Try using mdls (macOS) first
-    try:
-        result = subprocess.run(
-            ["mdls", "-name", "kMDItemNumberOfPages", str(pdf_path)],
-            capture_output=True,
-            text=True
-        )
-        if result.returncode == 0:
-            # Parse output like: kMDItemNumberOfPages = 5
-            match = re.search(r'kMDItemNumberOfPages\s*=\s*(\d+)', result.stdout)
-            if match:
-                return int(match.group(1))
-    except Exception:
-        pass
-    
-    # Try using pdfinfo (if poppler is installed)
+@functools.lru_cache(maxsize=32)
+def _read_pdf_page_count(pdf_path: str, mtime_ns: int, size: int) -> int:
+    """Page count for a specific version (mtime/size) of a PDF file."""
     try:
-        result = subprocess.run(
-            ["pdfinfo", str(pdf_path)],
-            capture_output=True,
-            text=True
-        )
-        if result.returncode == 0:
-            # Parse output like: Pages:          5
-            match = re.search(r'Pages:\s*(\d+)', result.stdout)
-            if match:
-                return int(match.group(1))
+        # Only parses the xref and page tree, not the page contents
+        return len(PdfReader(pdf_path).pages)
     except Exception:
         pass
-    
-    # Fallback: parse PDF file directly to find page count
-    try:
-        with open(pdf_path, 'rb') as f:
-            content = f.read()
-            # Look for /Type /Page entries (not /Pages)
-            # This is a simple heuristic
-            count = content.count(b'/Type /Page')
-            # Subtract /Type /Pages entries
-            pages_count = content.count(b'/Type /Pages')
-            return count - pages_count if count > pages_count else count
-    except Exception:
-        pass
-    
-    # Last resort: try to find /Count in the PDF
+
     try:
-        with open(pdf_path, 'rb') as f:
-            content = f.read().decode('latin-1')
-            match = re.search(r'/Count\s+(\d+)', content)
-            if match:
-                return int(match.group(1))
+        import pikepdf  # optional fallback for PDFs pypdf can't parse
+        with pikepdf.open(pdf_path) as pdf:
+            return len(pdf.pages)
     except Exception:
-        pass
-    
+        return _scan_pdf_page_count(pdf_path)
+
+
+def _scan_pdf_page_count(pdf_path: str) -> int:
+    """
+    Last resort: the largest /Count entry in the file (the root page tree).
+    The file is memory-mapped and matched as bytes, so nothing is copied or
+    decoded. The last 64 KiB (where the page tree usually sits, next to the
+    xref) is searched before the whole file.
+    """
+    with open(pdf_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for start in (max(0, len(mm) - PDF_TAIL_SCAN_SIZE), 0):
+            counts = [int(m.group(1)) for m in _PDF_COUNT_RE.finditer(mm, start)]
+            if counts:
+                return max(counts)
     return None
 
 
+def get_pdf_page_count(pdf_path: Path) -> int:
+    """Get the number of pages in a PDF file."""
+    try:
+        stat = pdf_path.stat()
+        return _read_pdf_page_count(str(pdf_path), stat.st_mtime_ns, stat.st_size)
+    except Exception as e:
+        log.error("ERROR: Failed to read PDF page count: %s", e)
+        return None
+
+
 if __name__ == "__main__":
-    exit(main())
+    logging.basicConfig(
+        level=os.environ.get("PIPELINE_LOG", "INFO").upper(),
+        format="%(message)s",
+        stream=sys.stdout
+    )
+    exit(asyncio.run(main()))
 